@@ -1,3 +1,13 @@
+import heapq
+import math
+import multiprocessing
+import os
+import queue
+import threading
+
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
 import numpy as np
 import pandas as pd
 import trackpy as tp
@@ -7,17 +17,410 @@ import skvideo.io
 import skimage.io
 import skvideo.utils
 
-from skimage.filters import laplace, gaussian, threshold_otsu
+from skimage.filters import threshold_otsu
+from skimage.util import img_as_float32
 from skimage import measure
-from sklearn.cluster import OPTICS
+from sklearn.cluster import cluster_optics_xi
 from sklearn.neighbors import NearestNeighbors
-from scipy.spatial import distance_matrix
+from scipy import ndimage
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import ConvexHull, QhullError, distance_matrix
+from scipy.spatial.distance import pdist
 from pathlib import Path
-from typing import List, Union, Tuple
+from typing import Iterator, List, Union, Tuple
+
+try:
+    from numba import njit, prange
+
+    _HAS_NUMBA = True
+except ImportError:
+    _HAS_NUMBA = False
+
+
+def _gaussian_kernel(sigma: float, truncate: float = 4.0) -> np.ndarray:
+    """Returns the normalized 1d gaussian kernel used by
+    ``scipy.ndimage.gaussian_filter``.
+
+    Parameters
+    ----------
+    sigma : float
+        Standard deviation for Gaussian kernel
+    truncate : float, optional
+        Truncate the kernel at this many standard deviations, by default 4.0
+
+    Returns
+    -------
+    np.ndarray, shape=(2 * radius + 1,)
+    """
+    if sigma <= 1e-15:
+        return np.ones(1)
+    radius = int(truncate * sigma + 0.5)
+    x = np.arange(-radius, radius + 1)
+    weights = np.exp(-0.5 / sigma**2 * x**2)
+    return weights / weights.sum()
+
+
+if _HAS_NUMBA:
+
+    @njit(
+        parallel=True, cache=True, fastmath=True, boundscheck=False, nogil=True
+    )
+    def _filter_stack_numba(
+        frames: np.ndarray, out: np.ndarray, weights: np.ndarray
+    ) -> None:
+        """Applies a laplacian filter followed by a separable gaussian filter
+        to each frame of ``frames`` and writes the results to ``out``. Same
+        boundary modes as ``skimage.filters.laplace`` (``'reflect'``) and
+        ``skimage.filters.gaussian`` (``'nearest'``).
+
+        Parameters
+        ----------
+        frames : np.ndarray, shape=(frames, dim_1, dim_2)
+            C-contiguous array of frames
+        out : np.ndarray, shape=(frames, dim_1, dim_2)
+        weights : np.ndarray
+            1d gaussian kernel, see ``_gaussian_kernel``
+        """
+        num_frames, dim_1, dim_2 = frames.shape
+        radius = len(weights) // 2
+        for n in prange(num_frames):
+            frame = frames[n]
+            laplacian = np.empty((dim_1, dim_2), dtype=out.dtype)
+            for i in range(dim_1):
+                i_prev = max(i - 1, 0)
+                i_next = min(i + 1, dim_1 - 1)
+                for j in range(dim_2):
+                    j_prev = max(j - 1, 0)
+                    j_next = min(j + 1, dim_2 - 1)
+                    laplacian[i, j] = (
+                        4 * frame[i, j]
+                        - frame[i_prev, j]
+                        - frame[i_next, j]
+                        - frame[i, j_prev]
+                        - frame[i, j_next]
+                    )
+            # gaussian filter along the first dimension
+            smoothed = np.zeros((dim_1, dim_2), dtype=out.dtype)
+            for i in range(dim_1):
+                for k in range(-radius, radius + 1):
+                    i_k = min(max(i + k, 0), dim_1 - 1)
+                    weight = weights[k + radius]
+                    for j in range(dim_2):
+                        smoothed[i, j] += weight * laplacian[i_k, j]
+            # gaussian filter along the second dimension
+            for i in range(dim_1):
+                for j in range(dim_2):
+                    # starting from a product keeps the sum in out.dtype
+                    value = weights[0] * smoothed[i, max(j - radius, 0)]
+                    for k in range(-radius + 1, radius + 1):
+                        j_k = min(max(j + k, 0), dim_2 - 1)
+                        value += weights[k + radius] * smoothed[i, j_k]
+                    out[n, i, j] = value
+
+    @njit(parallel=True, cache=True, nogil=True, error_model="numpy")
+    def _score_edges_numba(
+        pos: np.ndarray,
+        node: np.ndarray,
+        neighbor: np.ndarray,
+        adjacency: np.ndarray,
+        adjacency_start: np.ndarray,
+        degree: np.ndarray,
+        c_avg_length: float,
+        c_angle: float,
+        c_length_diff: float,
+        l_avg: float,
+        l_max: float,
+        out: np.ndarray,
+    ) -> None:
+        """Scores every directed connection ``node -> neighbor`` and writes
+        the scores to ``out``, see ``SarcGraph._score_edges``.
+
+        Parameters
+        ----------
+        pos : np.ndarray, shape=(N, 2)
+        node, neighbor : np.ndarray, shape=(2E,)
+            end nodes of each directed connection
+        adjacency, adjacency_start, degree : np.ndarray
+            neighbors of each node in CSR format
+        out : np.ndarray, shape=(2E,)
+        """
+        for d in prange(len(node)):
+            n, m = node[d], neighbor[d]
+            v1_x = pos[m, 0] - pos[n, 0]
+            v1_y = pos[m, 1] - pos[n, 1]
+            l1 = math.sqrt(v1_x * v1_x + v1_y * v1_y)
+            if not l1 <= l_max:
+                out[d] = 0.0
+                continue
+            score = 0.0
+            for a in range(adjacency_start[m], adjacency_start[m] + degree[m]):
+                far_neighbor = adjacency[a]
+                if far_neighbor == n or far_neighbor == m:
+                    continue
+                v2_x = pos[m, 0] - pos[far_neighbor, 0]
+                v2_y = pos[m, 1] - pos[far_neighbor, 1]
+                l2 = math.sqrt(v2_x * v2_x + v2_y * v2_y)
+                d_theta = math.acos(
+                    (v1_x * v2_x + v1_y * v2_y) / (l1 * l2)
+                ) / (math.pi / 2)
+                angle_score = (1 - d_theta) ** 2 if d_theta >= 1 else 0.0
+                d_l = abs(l2 - l1) / l1
+                candidate = c_length_diff * (1 / (1 + d_l)) + (
+                    c_angle * angle_score
+                )
+                # same as np.maximum, nan wins
+                if candidate > score or candidate != candidate:
+                    score = candidate
+            out[d] = score + c_avg_length * math.exp(
+                -math.pi * (1 - l1 / l_avg) ** 2
+            )
+
+    @njit(parallel=True, cache=True, nogil=True, error_model="numpy")
+    def _accept_edges_numba(
+        vectors: np.ndarray,
+        scores: np.ndarray,
+        node_start: np.ndarray,
+        degree: np.ndarray,
+        score_threshold: float,
+        angle_threshold: float,
+        accepted: np.ndarray,
+    ) -> None:
+        """Marks the connections accepted by each node, see
+        ``SarcGraph._edges_validity``. The connections of each node are
+        stored contiguously and sorted by their scores, ties sorted by their
+        rank.
+
+        Parameters
+        ----------
+        vectors : np.ndarray, shape=(2E, 2)
+            vector from node to neighbor of each directed connection
+        scores : np.ndarray, shape=(2E,)
+        node_start, degree : np.ndarray, shape=(N,)
+            first connection and number of connections of each node
+        accepted : np.ndarray(dtype=bool), shape=(2E,)
+        """
+        for n in prange(len(degree)):
+            best = node_start[n]
+            # nodes with a NaN score accept no connection
+            has_nan = False
+            for k in range(best, best + degree[n]):
+                has_nan |= math.isnan(scores[k])
+            if degree[n] == 0 or has_nan or not scores[best] > score_threshold:
+                continue
+            accepted[best] = True
+            l1 = math.sqrt(vectors[best, 0] ** 2 + vectors[best, 1] ** 2)
+            for k in range(best + 1, best + degree[n]):
+                if not scores[k] > score_threshold:
+                    continue
+                l2 = math.sqrt(vectors[k, 0] ** 2 + vectors[k, 1] ** 2)
+                theta = math.acos(
+                    (
+                        vectors[k, 0] * vectors[best, 0]
+                        + vectors[k, 1] * vectors[best, 1]
+                    )
+                    / (l1 * l2)
+                ) / (math.pi / 2)
+                if theta > angle_threshold:
+                    accepted[k] = True
+                    break
+
+    @njit(cache=True, boundscheck=False, nogil=True)
+    def _find_root(parent: np.ndarray, label: int) -> int:
+        while parent[label] != label:
+            parent[label] = parent[parent[label]]
+            label = parent[label]
+        return label
+
+    @njit(cache=True, boundscheck=False, nogil=True)
+    def _region_moments_numba(
+        frame: np.ndarray, threshold: float
+    ) -> np.ndarray:
+        """Thresholds a frame, labels its 4-connected regions and sums the
+        pixel moments of every region in two raster scans. Regions are
+        ordered by their first pixel, the same order as
+        ``scipy.ndimage.label``.
+
+        Parameters
+        ----------
+        frame : np.ndarray, shape=(dim_1, dim_2)
+        threshold : float
+
+        Returns
+        -------
+        np.ndarray, shape=(regions, 6)
+            area, sum of x, sum of y, sum of x^2, sum of y^2, and sum of x*y
+            of the pixels of each region
+        """
+        dim_1, dim_2 = frame.shape
+        labels = np.zeros((dim_1, dim_2), dtype=np.int32)
+        parent = np.empty(dim_1 * dim_2 + 1, dtype=np.int32)
+        num_labels = 0
+        # first scan: provisional labels, the root is the smallest label
+        for i in range(dim_1):
+            for j in range(dim_2):
+                if not frame[i, j] > threshold:
+                    continue
+                up = labels[i - 1, j] if i > 0 else 0
+                left = labels[i, j - 1] if j > 0 else 0
+                if up == 0 and left == 0:
+                    num_labels += 1
+                    parent[num_labels] = num_labels
+                    labels[i, j] = num_labels
+                elif up == 0 or left == 0:
+                    labels[i, j] = up + left
+                else:
+                    root_up = _find_root(parent, up)
+                    root_left = _find_root(parent, left)
+                    root = min(root_up, root_left)
+                    parent[root_up] = root
+                    parent[root_left] = root
+                    labels[i, j] = root
+        # second scan: number the regions and accumulate their moments
+        region = np.zeros(num_labels + 1, dtype=np.int32)
+        moments = np.zeros((num_labels, 6))
+        num_regions = 0
+        for i in range(dim_1):
+            for j in range(dim_2):
+                if labels[i, j] == 0:
+                    continue
+                root = _find_root(parent, labels[i, j])
+                if region[root] == 0:
+                    num_regions += 1
+                    region[root] = num_regions
+                r = region[root] - 1
+                moments[r, 0] += 1
+                moments[r, 1] += i
+                moments[r, 2] += j
+                moments[r, 3] += i * i
+                moments[r, 4] += j * j
+                moments[r, 5] += i * j
+        return moments[:num_regions]
+
+
+class _VideoReadError(Exception):
+    """Raised by ``SarcGraph._stream_frames`` when the video cannot be read
+    or decoded, the original error is its ``__cause__``."""
+
+
+def _rgb2gray(frames: np.ndarray) -> np.ndarray:
+    """Converts RGB frames to grayscale with ``skvideo.utils.rgb2gray`` and
+    casts the result to ``float32``. Single channel frames keep their dtype.
+
+    Parameters
+    ----------
+    frames : np.ndarray
+
+    Returns
+    -------
+    np.ndarray, shape=(frames, dim_1, dim_2, 1)
+    """
+    frames_gray = skvideo.utils.rgb2gray(frames)
+    if frames_gray.dtype == np.float64:
+        return frames_gray.astype(np.float32)
+    return frames_gray
+
+
+def _filter_stack(
+    frames: np.ndarray, sigma: float, out: Union[np.ndarray, None] = None
+) -> np.ndarray:
+    """Applies a laplacian filter followed by a gaussian filter to each
+    frame of ``frames`` using ``scipy.ndimage``. Module level so it can run
+    in worker processes.
+
+    Parameters
+    ----------
+    frames : np.ndarray, shape=(frames, dim_1, dim_2)
+        float32 array of frames
+    sigma : float
+        Standard deviation for Gaussian kernel
+    out : np.ndarray, optional
+        array to write the results to, by default a new array
+
+    Returns
+    -------
+    np.ndarray, shape=(frames, dim_1, dim_2)
+    """
+    # filter the whole stack at once, a kernel of size 1 (or sigma=0) along
+    # the first axis keeps the frames independent. The results match
+    # ``skimage.filters.laplace`` followed by ``skimage.filters.gaussian``
+    # applied to each frame.
+    laplace_kernel = np.array(
+        [[[0, -1, 0], [-1, 4, -1], [0, -1, 0]]], dtype=frames.dtype
+    )
+    laplacian = ndimage.convolve(frames, laplace_kernel, mode="reflect")
+    # the gaussian filter runs one line at a time, it can work in place
+    return ndimage.gaussian_filter(
+        laplacian,
+        sigma=(0, sigma, sigma),
+        output=laplacian if out is None else out,
+        mode="nearest",
+    )
+
+
+def _otsu_thresholds(
+    frames: np.ndarray, block_size: int = 1, num_samples: int = 8
+) -> np.ndarray:
+    """Returns an Otsu threshold for every frame of a stack. Consecutive
+    frames are grouped in blocks of ``block_size`` frames and all frames of a
+    block share one threshold computed from ``num_samples`` evenly spaced
+    frames of the block. With the default ``block_size=1`` every frame gets
+    its own Otsu threshold.
+
+    Parameters
+    ----------
+    frames : np.ndarray, shape=(frames, dim_1, dim_2)
+    block_size : int
+        by default 1
+    num_samples : int
+        by default 8
+
+    Returns
+    -------
+    np.ndarray, shape=(frames,)
+    """
+    thresholds = np.empty(len(frames))
+    for start in range(0, len(frames), block_size):
+        end = start + block_size
+        block = frames[start:end]
+        samples = block[:: max(1, len(block) // num_samples)]
+        thresholds[start:end] = threshold_otsu(samples.reshape(-1))
+    return thresholds
+
+
+def _frame_contours(
+    frame: np.ndarray, threshold: float, min_length: int
+) -> np.ndarray:
+    """Returns the contours of a filtered frame at ``threshold`` that have at
+    least ``min_length`` points. Module level so it can run in worker
+    processes.
+
+    Parameters
+    ----------
+    frame : np.ndarray, shape=(dim_1, dim_2)
+    threshold : float
+    min_length : int
+
+    Returns
+    -------
+    np.ndarray(dtype=object)
+    """
+    contours = np.array(
+        measure.find_contours(frame, threshold), dtype="object"
+    )
+    contours_size = list(np.vectorize(len)(contours))
+    return contours[np.greater_equal(contours_size, min_length)]
 
 
 class SarcGraph:
-    def __init__(self, output_dir: str = "test-run", file_type: str = "video"):
+    def __init__(
+        self,
+        output_dir: str = "test-run",
+        file_type: str = "video",
+        num_workers: int = 1,
+        zdisc_method: str = "contours",
+        otsu_block_size: int = 1,
+    ):
         """Zdiscs and sarcomeres segmentation and tracking.
 
         Attributes
@@ -27,17 +430,50 @@ class SarcGraph:
         file_type : str, optional
             use ``'image'`` for single-frame samples and ``'video'`` for
             multi-frame samples, by default ``'video'``
+        num_workers : int, optional
+            number of worker processes used to filter frames and detect
+            zdisc contours, e.g. ``os.cpu_count()``. The default ``1`` runs
+            everything in the current process. Workers are spawned, scripts
+            using ``num_workers > 1`` need an ``if __name__ == '__main__':``
+            guard.
+        zdisc_method : str, optional
+            use ``'contours'`` to locate zdiscs from the contours of the
+            filtered frames, or ``'moments'`` to locate them from the pixel
+            moments of the thresholded frames, which is faster but saves no
+            ``contours.npy`` for visualization, by default ``'contours'``
+        otsu_block_size : int, optional
+            number of consecutive frames that share one Otsu threshold
+            computed from a few of them, which saves some time on long videos
+            but changes the detected zdiscs when the intensity varies between
+            frames. The default ``1`` thresholds every frame on its own.
         """
         if file_type not in ["video", "image"]:
             raise ValueError(
                 f"{file_type} is not recognized as a valid file_type. Choose "
                 "from ['video', 'image']."
             )
+        if zdisc_method not in ["contours", "moments"]:
+            raise ValueError(
+                f"{zdisc_method} is not recognized as a valid zdisc_method. "
+                "Choose from ['contours', 'moments']."
+            )
         if not isinstance(output_dir, str):
             raise TypeError("output_dir must be a string.")
-        Path(f"{output_dir}").mkdir(parents=True, exist_ok=True)
+        if not isinstance(num_workers, int):
+            raise TypeError("num_workers must be an integer.")
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1.")
+        if not isinstance(otsu_block_size, int):
+            raise TypeError("otsu_block_size must be an integer.")
+        if otsu_block_size < 1:
+            raise ValueError("otsu_block_size must be at least 1.")
+        self._out = Path(output_dir)
+        self._out.mkdir(parents=True, exist_ok=True)
         self.output_dir = output_dir
         self.file_type = file_type
+        self.num_workers = num_workers
+        self.zdisc_method = zdisc_method
+        self.otsu_block_size = otsu_block_size
 
     ###########################################################
     #                    Utility Functions                    #
@@ -61,6 +497,69 @@ class SarcGraph:
                 return data
         return skimage.io.imread(file_path)
 
+    def _stream_frames(
+        self, file_path: str, prefetch: int = 8
+    ) -> Iterator[np.ndarray]:
+        """Reads a video frame by frame in a background thread and yields
+        the frames in gray scale, so decoding the video overlaps with
+        processing the frames already read.
+
+        Parameters
+        ----------
+        file_path : str
+            A video file address
+        prefetch : int, optional
+            maximum number of frames read ahead of the consumer, by default 8
+
+        Yields
+        ------
+        np.ndarray, shape=(1, dim_1, dim_2, 1)
+            A single frame in gray scale
+
+        Raises
+        ------
+        _VideoReadError
+            If reading or decoding the video fails
+        """
+        frames_queue = queue.Queue(maxsize=prefetch)
+        stop = threading.Event()
+        end_of_video = object()
+
+        def put(item):
+            # blocks while the queue is full unless the consumer has stopped
+            while not stop.is_set():
+                try:
+                    frames_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def reader():
+            try:
+                for frame in skvideo.io.vreader(file_path):
+                    if not put(_rgb2gray(frame)):
+                        return
+                put(end_of_video)
+            except Exception as e:
+                put(e)
+
+        reader_thread = threading.Thread(target=reader, daemon=True)
+        reader_thread.start()
+        try:
+            while True:
+                item = frames_queue.get()
+                if item is end_of_video:
+                    break
+                if isinstance(item, Exception):
+                    raise _VideoReadError(
+                        f"Not able to read a video from {file_path}."
+                    ) from item
+                yield item
+        finally:
+            stop.set()
+            reader_thread.join()
+
     def _to_gray(self, frames: np.ndarray) -> np.ndarray:
         """Convert RGB frames to grayscale.
 
@@ -72,9 +571,10 @@ class SarcGraph:
         Returns
         -------
         numpy.ndarray
-            All frames in gray scale
+            All frames in gray scale, ``float32`` for RGB frames, single
+            channel frames keep their dtype
         """
-        frames_gray = skvideo.utils.rgb2gray(frames)
+        frames_gray = _rgb2gray(frames)
         if self.file_type == "video" and frames_gray.shape[0] < 2:
             raise ValueError(
                 "Failed to load video correctly! Manually load the video into "
@@ -101,9 +601,7 @@ class SarcGraph:
         if not isinstance(file_name, str):
             raise TypeError("file_name must be a string.")
         if isinstance(data, np.ndarray) or isinstance(data, List):
-            np.save(
-                f"./{self.output_dir}/{file_name}.npy", data, allow_pickle=True
-            )
+            np.save(self._out / f"{file_name}.npy", data, allow_pickle=True)
             return
 
         raise TypeError("data must be a numpy.ndarray or a List.")
@@ -119,26 +617,55 @@ class SarcGraph:
         if not isinstance(file_name, str):
             raise TypeError("file_name must be a string.")
         if isinstance(data, pd.DataFrame):
-            data.to_csv(f"./{self.output_dir}/{file_name}.csv")
+            data.to_csv(self._out / f"{file_name}.csv")
             return
         raise TypeError(
             f"'data' type is {type(data)}. 'data' must be a pandas DataFrame."
         )
 
+    def _executor(self, max_workers: int = None) -> ProcessPoolExecutor:
+        """Returns a pool of ``num_workers`` worker processes. Workers are
+        started with ``'spawn'``, forking a process that already runs threads
+        (the decoding thread or numba's threading layer) is not safe.
+
+        Parameters
+        ----------
+        max_workers : int, optional
+            number of worker processes, by default ``num_workers``
+
+        Returns
+        -------
+        ProcessPoolExecutor
+        """
+        return ProcessPoolExecutor(
+            max_workers=max_workers or self.num_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
     def _filter_frames(
-        self, frames: np.ndarray, sigma: float = 1.0
+        self,
+        frames: np.ndarray,
+        sigma: float = 1.0,
+        out: Union[np.ndarray, None] = None,
     ) -> np.ndarray:
-        """Convolves all frames with laplacian and gaussian filters.
+        """Convolves all frames with laplacian and gaussian filters. With
+        ``num_workers > 1`` the frames are split into chunks filtered by
+        ``scipy.ndimage`` in worker processes, otherwise a compiled kernel is
+        used if ``numba`` is installed and ``scipy.ndimage`` if not.
 
         Parameters
         ----------
         frames : np.ndarray
         sigma : float
             Standard deviation for Gaussian kernel
+        out : np.ndarray, optional
+            ``float32`` array of shape (frames, dim_1, dim_2) to write the
+            results to, e.g. a memory-mapped ``.npy`` file, by default a new
+            array
 
         Returns
         -------
-        np.ndarray, shape=(frames, dim_1, dim_2)
+        np.ndarray, shape=(frames, dim_1, dim_2), dtype=float32
         """
         if frames.ndim > 4 or frames.ndim < 3:
             raise ValueError(
@@ -152,11 +679,89 @@ class SarcGraph:
                     "shape: (frames, dim_1, dim_2, channels=1 (optional))"
                 )
             frames = frames[:, :, :, 0]
-        filtered_frames = np.zeros(frames.shape)
-        for i, frame in enumerate(frames):
-            laplacian = laplace(frame)
-            filtered_frames[i] = gaussian(laplacian, sigma=sigma)
-        return filtered_frames
+        frames = img_as_float32(frames)
+        if self.num_workers > 1 and len(frames) > 1:
+            # worker processes take the place of numba's threads
+            chunks = np.array_split(frames, min(self.num_workers, len(frames)))
+            with self._executor(len(chunks)) as executor:
+                return np.concatenate(
+                    list(executor.map(_filter_stack, chunks, repeat(sigma))),
+                    out=out,
+                )
+        if _HAS_NUMBA:
+            frames = np.ascontiguousarray(frames)
+            filtered_frames = np.empty_like(frames) if out is None else out
+            _filter_stack_numba(
+                frames,
+                np.asarray(filtered_frames),
+                _gaussian_kernel(sigma).astype(frames.dtype),
+            )
+            return filtered_frames
+        return _filter_stack(frames, sigma, out)
+
+    def _stream_filter_frames(
+        self, file_path: str, sigma: float = 1.0, chunk_size: int = 16
+    ) -> Union[Tuple[np.ndarray, np.ndarray], None]:
+        """Loads a video and filters its frames in chunks while the rest of
+        the video is being decoded. With ``num_workers > 1`` the chunks are
+        filtered in worker processes.
+
+        Parameters
+        ----------
+        file_path : str
+            A video file address
+        sigma : float
+            Standard deviation for Gaussian kernel
+        chunk_size : int, optional
+            number of frames filtered at once, by default 16
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray] or None
+            All frames in gray scale, shape=(frames, dim_1, dim_2, 1), and
+            all filtered frames, shape=(frames, dim_1, dim_2). ``None`` if the
+            file could not be read as a video with more than one frame, errors
+            raised while filtering the frames are not caught.
+        """
+        if self.num_workers > 1:
+            executor = self._executor()
+
+            def filter_chunk(chunk):
+                chunk = img_as_float32(chunk[:, :, :, 0])
+                return executor.submit(_filter_stack, chunk, sigma)
+
+        else:
+            executor = None
+
+            def filter_chunk(chunk):
+                return self._filter_frames(chunk, sigma)
+
+        frames_gray, frames_filtered, chunk = [], [], []
+        frames = self._stream_frames(file_path)
+        try:
+            for frame in frames:
+                chunk.append(frame)
+                if len(chunk) == chunk_size:
+                    chunk = np.concatenate(chunk)
+                    frames_gray.append(chunk)
+                    frames_filtered.append(filter_chunk(chunk))
+                    chunk = []
+            if chunk:
+                chunk = np.concatenate(chunk)
+                frames_gray.append(chunk)
+                frames_filtered.append(filter_chunk(chunk))
+            if executor is not None:
+                frames_filtered = [f.result() for f in frames_filtered]
+        except _VideoReadError:
+            return None
+        finally:
+            # stops the reader thread if filtering failed
+            frames.close()
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+        if sum(len(frames) for frames in frames_gray) < 2:
+            return None
+        return np.concatenate(frames_gray), np.concatenate(frames_filtered)
 
     #############################################################
     #                    Z-Disc Segmentation                    #
@@ -184,14 +789,22 @@ class SarcGraph:
         Returns
         -------
         np.ndarray, shape=(frames, dim_1, dim_2)
+            The filtered frames. If ``save_output`` is True and the frames
+            are not streamed from a video file (``raw_frames``, images and
+            image stacks) they are filtered straight into
+            ``filtered-frames.npy`` and the returned array maps that file,
+            except on Windows.
         """
+        processed_frames = None
         if raw_frames is None:
             if file_path is None:
                 raise ValueError(
                     "Either file_path or raw_frames should be given as"
                     " input."
                 )
-            else:
+            if self.file_type == "video":
+                processed_frames = self._stream_filter_frames(file_path, sigma)
+            if processed_frames is None:
                 try:
                     raw_frames = self._data_loader(file_path)
                 except Exception:
@@ -199,13 +812,46 @@ class SarcGraph:
                         f"Not able to load a file from {file_path}."
                     )
 
-        if not isinstance(raw_frames, np.ndarray):
-            raise TypeError("raw_frames must be a numpy array.")
-        raw_frames_gray = self._to_gray(raw_frames)
-        raw_frames_filtered = self._filter_frames(raw_frames_gray, sigma)
+        if processed_frames is None:
+            if not isinstance(raw_frames, np.ndarray):
+                raise TypeError("raw_frames must be a numpy array.")
+            raw_frames_gray = self._to_gray(raw_frames)
+            if save_output and os.name == "posix":
+                # filter straight into a new file that replaces the saved one
+                # once filtering succeeds, arrays returned by earlier calls
+                # keep mapping the old file. Windows can not replace mapped
+                # files, there the filtered frames are saved after filtering.
+                filtered_path = self._out / "filtered-frames.npy.tmp"
+                try:
+                    raw_frames_filtered = self._filter_frames(
+                        raw_frames_gray,
+                        sigma,
+                        out=np.lib.format.open_memmap(
+                            filtered_path,
+                            mode="w+",
+                            dtype=np.float32,
+                            shape=raw_frames_gray.shape[:3],
+                        ),
+                    )
+                    raw_frames_filtered.flush()
+                except BaseException:
+                    filtered_path.unlink(missing_ok=True)
+                    raise
+                os.replace(filtered_path, self._out / "filtered-frames.npy")
+            else:
+                raw_frames_filtered = self._filter_frames(
+                    raw_frames_gray, sigma
+                )
+        else:
+            raw_frames_gray, raw_frames_filtered = processed_frames
         if save_output:
             self._save_numpy(raw_frames_gray, file_name="raw-frames")
-            self._save_numpy(raw_frames_filtered, file_name="filtered-frames")
+            if not isinstance(raw_frames_filtered, np.memmap):
+                # the saved file may be mapped by an earlier returned array
+                (self._out / "filtered-frames.npy").unlink(missing_ok=True)
+                self._save_numpy(
+                    raw_frames_filtered, file_name="filtered-frames"
+                )
         return raw_frames_filtered
 
     def _detect_contours(
@@ -247,17 +893,23 @@ class SarcGraph:
                 min_length = int(min_length)
             except ValueError:
                 raise ValueError("min_length must be an integer.") from None
-        length_checker = np.vectorize(len)
-        valid_contours = []
-        for frame in filtered_frames:
-            contour_thresh = threshold_otsu(frame)
-            contours = np.array(
-                measure.find_contours(frame, contour_thresh), dtype="object"
-            )
-            contours_size = list(length_checker(contours))
-            valid_contours.append(
-                contours[np.greater_equal(contours_size, min_length)]
-            )
+        thresholds = _otsu_thresholds(filtered_frames, self.otsu_block_size)
+        if self.num_workers > 1 and len(filtered_frames) > 1:
+            with self._executor() as executor:
+                valid_contours = list(
+                    executor.map(
+                        _frame_contours,
+                        filtered_frames,
+                        thresholds,
+                        repeat(min_length),
+                        chunksize=-(-len(filtered_frames) // self.num_workers),
+                    )
+                )
+        else:
+            valid_contours = [
+                _frame_contours(frame, threshold, min_length)
+                for frame, threshold in zip(filtered_frames, thresholds)
+            ]
         valid_contours = np.array(valid_contours, dtype="object")
         if save_output:
             self._save_numpy(valid_contours, file_name="contours")
@@ -278,14 +930,184 @@ class SarcGraph:
         """
         if len(contour) < 3:
             raise ValueError("A contour must have at least 3 coordinates.")
+        contour = np.asarray(contour)
         # center of a contour
         center_coords = np.mean(contour, axis=0)
         # coordinates of the two points on the contour with maximum distance
-        dist_mat = distance_matrix(contour, contour)
-        indices = np.unravel_index(dist_mat.argmax(), dist_mat.shape)
-        p1, p2 = contour[indices[0]], contour[indices[1]]
+        p1, p2 = self._farthest_points(contour)
         return np.hstack((center_coords, p1, p2))
 
+    def _farthest_points(
+        self, contour: np.ndarray, hull_min_length: int = 64
+    ) -> np.ndarray:
+        """Finds the two points on a contour with maximum distance. If there
+        are multiple pairs with the same distance the first pair in the order
+        of the contour points is returned.
+
+        Parameters
+        ----------
+        contour : np.ndarray, shape=(contour_length, 2)
+        hull_min_length : int, optional
+            for contours longer than ``hull_min_length`` only the points on
+            the convex hull of the contour are compared, by default 64
+
+        Returns
+        -------
+        np.ndarray, shape=(2, 2)
+        """
+        points = contour
+        if len(contour) > hull_min_length:
+            # the two farthest points are always on the convex hull. Keep
+            # every contour point that coincides with a hull point so that
+            # ties are resolved the same way as with all points.
+            try:
+                hull = ConvexHull(contour)
+                hull_points = contour[
+                    np.union1d(hull.vertices, hull.coplanar[:, 0])
+                ]
+                on_hull = np.any(
+                    np.all(contour[:, None] == hull_points[None], axis=2),
+                    axis=1,
+                )
+                points = contour[on_hull]
+            except QhullError:
+                # degenerate contours, e.g. all points on a line
+                pass
+        # map the index of the maximum pairwise distance in the condensed
+        # distance vector back to the corresponding pair of points
+        n = len(points)
+        k = pdist(points).argmax()
+        i = int(np.floor((2 * n - 1 - np.sqrt((2 * n - 1) ** 2 - 8 * k)) / 2))
+        j = int(k - i * (2 * n - 1 - i) // 2 + i + 1)
+        return points[[i, j]]
+
+    def _process_contours(
+        self, contours: Union[List, np.ndarray]
+    ) -> np.ndarray:
+        """Computes the center location and the two end points of all zdiscs
+        in a frame given their 2d contours.
+
+        Parameters
+        ----------
+        contours : List[np.ndarray]
+            contours of zdiscs in a frame, each with the shape
+            (contour_length, 2)
+
+        Returns
+        -------
+        np.ndarray, shape=(number of zdiscs, 6)
+            zdiscs center, end point 1, end point 2
+        """
+        if len(contours) == 0:
+            return np.zeros((0, 6))
+        lengths = np.array([len(contour) for contour in contours])
+        if np.any(lengths < 3):
+            raise ValueError("A contour must have at least 3 coordinates.")
+        # stack all contours in a single array and find the center of each
+        # contour with one reduction over the contour segments
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        all_points = np.concatenate(list(contours)).astype(float)
+        centers_coords = (
+            np.add.reduceat(all_points, offsets[:-1], axis=0)
+            / lengths[:, None]
+        )
+        end_points = np.zeros((len(contours), 4))
+        for i, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+            end_points[i] = self._farthest_points(
+                all_points[start:end]
+            ).ravel()
+        return np.hstack((centers_coords, end_points))
+
+    def _zdiscs_from_moments(
+        self, filtered_frames: np.ndarray, min_area: int = 8
+    ) -> List[np.ndarray]:
+        """Finds zdiscs as the connected regions of the filtered frames above
+        their Otsu thresholds. The center of a zdisc is the centroid of its
+        region and its end points are the ends of the major axis of the
+        ellipse with the same second moments as the region, the same values
+        as ``skimage.measure.regionprops``. See ``otsu_block_size`` of
+        :class:`sarcgraph.sg.SarcGraph` for the thresholds.
+
+        Parameters
+        ----------
+        filtered_frames : np.ndarray, shape=(frames, dim_1, dim_2)
+        min_area : int
+            Minimum area of zdisc regions measured in pixels, by default 8
+
+        Returns
+        -------
+        List[np.ndarray]
+            Information of zdiscs in each frame, every array has the shape
+            (zdiscs, 6) with columns x, y, p1_x, p1_y, p2_x, p2_y
+        """
+        if filtered_frames.ndim != 3:
+            raise ValueError(
+                "Input array must have the shape (frames, dim_1, dim_2)."
+            )
+        thresholds = _otsu_thresholds(filtered_frames, self.otsu_block_size)
+        if _HAS_NUMBA:
+            # threshold, label and sum moments one frame at a time, no
+            # binary or label stacks are kept in memory
+            moments = [
+                _region_moments_numba(frame, threshold)
+                for frame, threshold in zip(
+                    np.asarray(filtered_frames), thresholds
+                )
+            ]
+            region_frame = np.repeat(
+                np.arange(len(moments)), [len(m) for m in moments]
+            )
+            moments = np.concatenate(moments)
+        else:
+            binary = filtered_frames > thresholds[:, None, None]
+            # label all frames at once, regions do not connect across frames
+            structure = np.zeros((3, 3, 3), dtype=bool)
+            structure[1] = ndimage.generate_binary_structure(2, 1)
+            labels, num_regions = ndimage.label(binary, structure=structure)
+
+            # pixel moments of every region, labels are ordered by frame
+            frame, x, y = np.nonzero(labels)
+            region = labels[frame, x, y] - 1
+            moments = np.stack(
+                [
+                    np.bincount(region, weights, minlength=num_regions)
+                    for weights in (None, x, y, x * x, y * y, x * y)
+                ],
+                axis=1,
+            )
+            region_frame = np.zeros(num_regions, dtype=int)
+            region_frame[region] = frame
+
+        area = moments[:, 0]
+        x_mean, y_mean = moments[:, 1] / area, moments[:, 2] / area
+        var_x = moments[:, 3] / area - x_mean**2
+        var_y = moments[:, 4] / area - y_mean**2
+        cov_xy = moments[:, 5] / area - x_mean * y_mean
+
+        # half of the major axis of the equivalent ellipse
+        eigval = (var_x + var_y) / 2 + np.sqrt(
+            ((var_x - var_y) / 2) ** 2 + cov_xy**2
+        )
+        theta = np.arctan2(2 * cov_xy, var_x - var_y) / 2
+        dx = 2 * np.sqrt(np.maximum(eigval, 0)) * np.cos(theta)
+        dy = 2 * np.sqrt(np.maximum(eigval, 0)) * np.sin(theta)
+        zdiscs = np.stack(
+            (
+                x_mean,
+                y_mean,
+                x_mean - dx,
+                y_mean - dy,
+                x_mean + dx,
+                y_mean + dy,
+            ),
+            axis=1,
+        )
+
+        is_valid = area >= min_area
+        zdiscs, region_frame = zdiscs[is_valid], region_frame[is_valid]
+        counts = np.bincount(region_frame, minlength=len(filtered_frames))
+        return np.split(zdiscs, np.cumsum(counts)[:-1])
+
     def _zdiscs_to_pandas(self, zdiscs_all: List[np.ndarray]) -> pd.DataFrame:
         """Creates a pandas dataframe from the information of detected zdiscs
         in all frames.
@@ -312,8 +1134,7 @@ class SarcGraph:
                 "More than one frame detected. The image is not loaded "
                 "correctly."
             )
-        data_frame = []
-        for i, zdiscs_frame in enumerate(zdiscs_all):
+        for zdiscs_frame in zdiscs_all:
             if type(zdiscs_frame) != np.ndarray:
                 raise TypeError("Input should be a list of numpy arrays.")
             if zdiscs_frame.ndim != 2 or zdiscs_frame.shape[1] != 6:
@@ -321,23 +1142,17 @@ class SarcGraph:
                     "Each numpy array must have the shape: (number of zdiscs, "
                     "6)"
                 )
-            frame_id = i * np.ones((len(zdiscs_frame), 1), dtype=int)
-            zdiscs_frame_extended = np.hstack((frame_id, zdiscs_frame))
-            data_frame.append(
-                pd.DataFrame(
-                    zdiscs_frame_extended,
-                    columns=[
-                        "frame",
-                        "x",
-                        "y",
-                        "p1_x",
-                        "p1_y",
-                        "p2_x",
-                        "p2_y",
-                    ],
-                )
-            )
-        return pd.concat(data_frame)
+        # one dataframe for all frames, the index restarts in every frame
+        counts = np.array([len(zdiscs_frame) for zdiscs_frame in zdiscs_all])
+        frame_id = np.repeat(np.arange(len(zdiscs_all)), counts)
+        index = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        return pd.DataFrame(
+            np.column_stack((frame_id, np.concatenate(zdiscs_all))),
+            columns=["frame", "x", "y", "p1_x", "p1_y", "p2_x", "p2_y"],
+            index=index,
+        )
 
     def zdisc_segmentation(
         self,
@@ -359,7 +1174,8 @@ class SarcGraph:
         sigma : float
             Standard deviation for Gaussian kernel
         min_length : int
-            Minimum length for zdisc contours measured in pixels
+            Minimum length for zdisc contours measured in pixels, or minimum
+            area of zdisc regions with ``zdisc_method='moments'``
         save_output : bool
             by default True
 
@@ -374,15 +1190,16 @@ class SarcGraph:
         filtered_frames = self._process_input(
             file_path, raw_frames, sigma, save_output
         )
-        contours_all = self._detect_contours(
-            filtered_frames, min_length, save_output
-        )
-        zdiscs_all = []
-        for contours_frame in contours_all:
-            zdiscs_frame = np.zeros((len(contours_frame), 6))
-            for i, contour in enumerate(contours_frame):
-                zdiscs_frame[i] = self._process_contour(contour)
-            zdiscs_all.append(zdiscs_frame)
+        if self.zdisc_method == "moments":
+            zdiscs_all = self._zdiscs_from_moments(filtered_frames, min_length)
+        else:
+            contours_all = self._detect_contours(
+                filtered_frames, min_length, save_output
+            )
+            zdiscs_all = [
+                self._process_contours(contours_frame)
+                for contours_frame in contours_all
+            ]
         zdiscs_all_dataframe = self._zdiscs_to_pandas(zdiscs_all)
         if save_output:
             self._save_dataframe(
@@ -393,6 +1210,84 @@ class SarcGraph:
     #########################################################
     #                    Z-disc Tracking                    #
     #########################################################
+    def _optics_labels(
+        self, data: np.ndarray, max_eps: float, min_samples: int = 2
+    ) -> np.ndarray:
+        """Cluster labels of ``sklearn.cluster.OPTICS(max_eps=max_eps,
+        min_samples=min_samples).fit_predict(data)``. The reachability graph
+        is built from the neighbors of each point within ``max_eps``, found
+        once, and points are processed in the order of a heap instead of
+        searching all unprocessed points at every step. Distances, rounding
+        and tie breaking follow ``sklearn.cluster.compute_optics_graph``,
+        clusters are extracted with ``sklearn.cluster.cluster_optics_xi``.
+
+        Parameters
+        ----------
+        data : np.ndarray, shape=(N, 2)
+        max_eps : float
+        min_samples : int, optional
+            by default 2
+
+        Returns
+        -------
+        np.ndarray, shape=(N,)
+            cluster label of each point, noisy points are labeled -1
+        """
+        num_points = len(data)
+        if num_points < min_samples:
+            return -np.ones(num_points, dtype=int)
+        precision = np.finfo(float).precision
+        nbrs = NearestNeighbors(n_neighbors=min_samples).fit(data)
+        core_distances = nbrs.kneighbors(data, min_samples)[0][:, -1]
+        core_distances[core_distances > max_eps] = np.inf
+        np.around(core_distances, decimals=precision, out=core_distances)
+
+        # reachability distance of every point to its neighbors
+        neighbors = nbrs.radius_neighbors(
+            data, radius=max_eps, return_distance=False
+        )
+        counts = [len(n) for n in neighbors]
+        neighbors_start = np.concatenate(([0], np.cumsum(counts))).tolist()
+        point = np.repeat(np.arange(num_points), counts)
+        neighbor = np.concatenate(list(neighbors))
+        diff = data[neighbor] - data[point]
+        reach_distances = np.maximum(
+            np.sqrt(np.sum(diff * diff, axis=1)), core_distances[point]
+        )
+        np.around(reach_distances, decimals=precision, out=reach_distances)
+
+        # process the points with the smallest reachability first, smaller
+        # ids first on ties
+        reachability = [np.inf] * num_points
+        predecessor = -np.ones(num_points, dtype=int)
+        ordering = []
+        processed = np.zeros(num_points, dtype=bool)
+        heap = [(np.inf, p) for p in range(num_points)]
+        neighbor, reach_distances = neighbor.tolist(), reach_distances.tolist()
+        is_core = np.isfinite(core_distances).tolist()
+        while heap:
+            _, p = heapq.heappop(heap)
+            if processed[p]:
+                continue
+            processed[p] = True
+            ordering.append(p)
+            if not is_core[p]:
+                continue
+            for k in range(neighbors_start[p], neighbors_start[p + 1]):
+                q, reach = neighbor[k], reach_distances[k]
+                if not processed[q] and reach < reachability[q]:
+                    reachability[q] = reach
+                    predecessor[q] = p
+                    heapq.heappush(heap, (reach, q))
+
+        labels, _ = cluster_optics_xi(
+            reachability=np.array(reachability),
+            predecessor=predecessor,
+            ordering=np.array(ordering),
+            min_samples=min_samples,
+        )
+        return labels
+
     def _merge_tracked_zdiscs(
         self,
         tracked_zdiscs: pd.DataFrame,
@@ -422,14 +1317,13 @@ class SarcGraph:
         https://scikit-learn.org/stable/modules/generated/sklearn.cluster.OPTICS.html
         """
         num_frames = tracked_zdiscs.frame.max() + 1
-        tracked_zdiscs_grouped = tracked_zdiscs.groupby("particle")["particle"]
-        tracked_zdiscs["freq"] = tracked_zdiscs_grouped.transform("count")
-        fully_tracked_zdiscs = tracked_zdiscs.loc[
-            tracked_zdiscs.freq == num_frames
-        ]
-        partially_tracked_zdiscs = tracked_zdiscs.loc[
-            tracked_zdiscs.freq < num_frames
-        ]
+        particle_counts = tracked_zdiscs["particle"].value_counts()
+        tracked_zdiscs["freq"] = tracked_zdiscs["particle"].map(
+            particle_counts
+        )
+        is_fully_tracked = tracked_zdiscs.freq == num_frames
+        fully_tracked_zdiscs = tracked_zdiscs.loc[is_fully_tracked]
+        partially_tracked_zdiscs = tracked_zdiscs.loc[~is_fully_tracked]
 
         if partially_tracked_zdiscs.empty:
             return fully_tracked_zdiscs
@@ -451,8 +1345,7 @@ class SarcGraph:
         )
         optics_max_eps = np.mean(clusters_min_dist)
         data = np.array(partially_tracked_clusters)
-        optics_model = OPTICS(max_eps=optics_max_eps, min_samples=2)
-        optics_result = optics_model.fit_predict(data)
+        optics_result = self._optics_labels(data, optics_max_eps)
         optics_clusters = np.unique(optics_result)
 
         all_merged_zdiscs = []
@@ -615,33 +1508,95 @@ class SarcGraph:
         -------
         nx.Graph
         """
-        num_nodes = len(zdiscs)
-        G = nx.Graph()
-        G.add_nodes_from(range(num_nodes))
+        edges = self._zdisc_to_edges(zdiscs[:, 0:2], K)
+        return self._arrays_to_graph(zdiscs[:, 0:2], zdiscs[:, -1], edges)
 
-        # add the position of each zdisc as a node attribute to the graph
-        nodes_pos_dict = {i: pos for i, pos in enumerate(zdiscs[:, 0:2])}
-        nodes_particle_dict = {j: id for j, id in enumerate(zdiscs[:, -1])}
+    def _zdisc_to_edges(self, pos: np.ndarray, K: int = 3) -> np.ndarray:
+        """Connects each zdisc to its ``K`` nearest neighbors.
 
-        nx.set_node_attributes(G, values=nodes_pos_dict, name="pos")
-        nx.set_node_attributes(
-            G, values=nodes_particle_dict, name="particle_id"
-        )
+        Parameters
+        ----------
+        pos : np.ndarray, shape=(N, 2)
+            x and y location of zdisc centers
+        K : int, optional
+            number of nearest neighbors for each zdisc, by default 3
 
+        Returns
+        -------
+        np.ndarray, shape=(E, 2)
+            node indices of each connection, each connection appears once
+            with the lower index first. Connections are in the order they are
+            first found going through the neighbors of each zdisc, the order
+            they are added to the graph of
+            :func:`sarcgraph.sg.SarcGraph._zdisc_to_graph`.
+        """
+        num_nodes = len(pos)
+        if num_nodes <= K:
+            raise ValueError(
+                f"At least {K + 1} zdiscs are needed to find {K} nearest "
+                "neighbors."
+            )
         # find K nearest zdisc to each zdisc
         neigh = NearestNeighbors(n_neighbors=2)
-        neigh.fit(zdiscs[:, 0:2])
-        nearestNeighbors = neigh.kneighbors(
-            zdiscs[:, 0:2], K + 1, return_distance=False
+        neigh.fit(pos)
+        nearestNeighbors = neigh.kneighbors(pos, K + 1, return_distance=False)
+
+        # connect each zdisc to K nearest neighbors and keep the first
+        # occurrence of each connection
+        node = np.repeat(np.arange(num_nodes), K)
+        neighbor = nearestNeighbors[:, 1:].ravel()
+        edges = np.column_stack(
+            (np.minimum(node, neighbor), np.maximum(node, neighbor))
         )
+        _, first = np.unique(
+            edges[:, 0] * num_nodes + edges[:, 1], return_index=True
+        )
+        return edges[np.sort(first)]
+
+    def _arrays_to_graph(
+        self,
+        pos: np.ndarray,
+        particle_ids: np.ndarray,
+        edges: np.ndarray,
+        edges_attr: Union[dict, None] = None,
+        nodes: Union[np.ndarray, None] = None,
+    ) -> nx.Graph:
+        """Creates a graph of zdiscs from arrays of nodes and edges
+        information.
 
-        # connect each zdisc to K nearest neighbors
-        edges = []
-        for node, neighbors in enumerate(nearestNeighbors[:, 1:]):
-            for neighbor in neighbors:
-                edges.append((node, neighbor))
-        G.add_edges_from(edges)
+        Parameters
+        ----------
+        pos : np.ndarray, shape=(N, 2)
+            x and y location of zdisc centers
+        particle_ids : np.ndarray, shape=(N,)
+            particle id of each zdisc
+        edges : np.ndarray, shape=(E, 2)
+            node indices of each connection
+        edges_attr : dict, optional
+            arrays of shape (E,) of edge attributes keyed by the attribute
+            name, by default None
+        nodes : np.ndarray, optional
+            indices of the nodes in the graph, by default all nodes
 
+        Returns
+        -------
+        nx.Graph
+        """
+        if nodes is None:
+            nodes = range(len(pos))
+        else:
+            nodes = nodes.tolist()
+        G = nx.Graph()
+        G.add_nodes_from(
+            (i, {"pos": pos[i], "particle_id": particle_ids[i]}) for i in nodes
+        )
+        edges_list = [tuple(edge) for edge in edges.tolist()]
+        G.add_edges_from(edges_list)
+        if edges_attr is not None:
+            for name, values in edges_attr.items():
+                nx.set_edge_attributes(
+                    G, values=dict(zip(edges_list, values.tolist())), name=name
+                )
         return G
 
     def _score_graph(
@@ -685,58 +1640,123 @@ class SarcGraph:
         nx.Graph
             a graph of zdiscs with all connections scored
         """
-        edges_attr_dict = {}
-        for node in range(G.number_of_nodes()):
-            for neighbor in G.neighbors(node):
-                score = 0
-                v1 = G.nodes[neighbor]["pos"] - G.nodes[node]["pos"]
-                l1 = np.linalg.norm(v1)
-                if l1 <= l_max:
-                    avg_length_score = np.exp(-np.pi * (1 - l1 / l_avg) ** 2)
-                    for far_neighbor in G.neighbors(neighbor):
-                        if far_neighbor in [node, neighbor]:
-                            pass
-                        else:
-                            v2 = (
-                                G.nodes[neighbor]["pos"]
-                                - G.nodes[far_neighbor]["pos"]
-                            )  # vector connecting neighbor to far_neighbor
-                            l2 = np.linalg.norm(v2)
-
-                            d_theta = np.arccos(np.dot(v1, v2) / (l1 * l2)) / (
-                                np.pi / 2
-                            )
-                            d_l = np.abs(l2 - l1) / l1
-
-                            angle_score = (
-                                np.power(1 - d_theta, 2) if d_theta >= 1 else 0
-                            )
-                            diff_length_score = 1 / (1 + d_l)
-
-                            score = np.max(
-                                (
-                                    score,
-                                    c_length_diff * diff_length_score
-                                    + c_angle * angle_score,
-                                )
-                            )
-                    score += c_avg_length * avg_length_score
-                edges_attr_dict[(node, neighbor)] = score
-
-        edges_attr_dict_keep_max = {}
-        for key in edges_attr_dict.keys():
-            node_1 = key[0]
-            node_2 = key[1]
-            max_score = max(
-                edges_attr_dict[(node_1, node_2)],
-                edges_attr_dict[(node_2, node_1)],
-            )
-            edges_attr_dict_keep_max[(min(key), max(key))] = max_score
-        nx.set_edge_attributes(
-            G, values=edges_attr_dict_keep_max, name="score"
+        pos = np.array([G.nodes[node]["pos"] for node in range(len(G))])
+        edges = np.array(G.edges, dtype=int).reshape(-1, 2)
+        scores = self._score_edges(
+            pos, edges, c_avg_length, c_angle, c_length_diff, l_avg, l_max
         )
+        edges_attr_dict = {
+            (node_1, node_2): score
+            for (node_1, node_2), score in zip(edges.tolist(), scores)
+        }
+        nx.set_edge_attributes(G, values=edges_attr_dict, name="score")
         return G
 
+    def _score_edges(
+        self,
+        pos: np.ndarray,
+        edges: np.ndarray,
+        c_avg_length: float = 1.0,
+        c_angle: float = 1.0,
+        c_length_diff: float = 1.0,
+        l_avg: float = 15.0,
+        l_max: float = 30.0,
+    ) -> np.ndarray:
+        """Computes the score of every connection of a graph of zdiscs given
+        as arrays, with a compiled kernel if ``numba`` is installed. See
+        :func:`sarcgraph.sg.SarcGraph._score_graph` for the description of
+        the scoring parameters.
+
+        Parameters
+        ----------
+        pos : np.ndarray, shape=(N, 2)
+            position of the nodes (zdiscs)
+        edges : np.ndarray, shape=(E, 2)
+            node indices of each connection
+
+        Returns
+        -------
+        np.ndarray, shape=(E,)
+            score of each connection
+        """
+        num_nodes, num_edges = len(pos), len(edges)
+        # each connection in both directions: node -> neighbor
+        node = np.concatenate((edges[:, 0], edges[:, 1]))
+        neighbor = np.concatenate((edges[:, 1], edges[:, 0]))
+        # neighbors of each node
+        order = np.argsort(node, kind="stable")
+        adjacency = neighbor[order]
+        degree = np.bincount(node, minlength=num_nodes)
+        adjacency_start = np.concatenate(([0], np.cumsum(degree)[:-1]))
+
+        if _HAS_NUMBA:
+            directed_scores = np.empty(2 * num_edges)
+            _score_edges_numba(
+                np.ascontiguousarray(pos, dtype=float),
+                node,
+                neighbor,
+                adjacency,
+                adjacency_start,
+                degree,
+                c_avg_length,
+                c_angle,
+                c_length_diff,
+                l_avg,
+                l_max,
+                directed_scores,
+            )
+            # keep the higher score of the two directions
+            return np.maximum(
+                directed_scores[:num_edges], directed_scores[num_edges:]
+            )
+
+        v1 = pos[neighbor] - pos[node]
+        l1 = np.linalg.norm(v1, axis=1)
+
+        # all (node, neighbor, far_neighbor) triplets, far_neighbor is any
+        # neighbor of neighbor other than node and neighbor
+        counts = degree[neighbor]
+        triplet_edge = np.repeat(np.arange(2 * num_edges), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts, counts
+        )
+        far_neighbor = adjacency[
+            adjacency_start[neighbor[triplet_edge]] + offsets
+        ]
+        is_far = (far_neighbor != node[triplet_edge]) & (
+            far_neighbor != neighbor[triplet_edge]
+        )
+        triplet_edge, far_neighbor = triplet_edge[is_far], far_neighbor[is_far]
+
+        # vector connecting neighbor to far_neighbor
+        v2 = pos[neighbor[triplet_edge]] - pos[far_neighbor]
+        l2 = np.linalg.norm(v2, axis=1)
+        l1_triplet = l1[triplet_edge]
+        d_theta = np.arccos(
+            np.einsum("ij,ij->i", v1[triplet_edge], v2) / (l1_triplet * l2)
+        ) / (np.pi / 2)
+        d_l = np.abs(l2 - l1_triplet) / l1_triplet
+
+        angle_score = np.where(d_theta >= 1, np.power(1 - d_theta, 2), 0)
+        diff_length_score = 1 / (1 + d_l)
+
+        directed_scores = np.zeros(2 * num_edges)
+        np.maximum.at(
+            directed_scores,
+            triplet_edge,
+            c_length_diff * diff_length_score + c_angle * angle_score,
+        )
+        avg_length_score = np.exp(-np.pi * (1 - l1 / l_avg) ** 2)
+        directed_scores = np.where(
+            l1 <= l_max,
+            directed_scores + c_avg_length * avg_length_score,
+            0,
+        )
+        # keep the higher score of the two directions
+        return np.maximum(
+            directed_scores[:num_edges], directed_scores[num_edges:]
+        )
+
     def _prune_graph(
         self,
         G: nx.Graph,
@@ -762,42 +1782,228 @@ class SarcGraph:
         -------
         nx.Graph
         """
-        nx.set_edge_attributes(G, values=0, name="validity")
-        for node in range(G.number_of_nodes()):
-            vectors = []
-            scores = []
-            neighbors = list(G.neighbors(node))
-            for neighbor in neighbors:
-                vectors.append(G.nodes[neighbor]["pos"] - G.nodes[node]["pos"])
-                scores.append(G[node][neighbor]["score"])
-
-            # sort by scores
-            if np.max(scores) > score_threshold:
-                sort_indices = np.argsort(scores)[::-1]
-                best_vector = vectors[sort_indices[0]]
-                G[node][neighbors[sort_indices[0]]]["validity"] += 1
-                for idx in sort_indices[1:]:
-                    s = scores[idx]
-                    n = neighbors[idx]
-                    v = vectors[idx]
-
-                    l1 = np.linalg.norm(best_vector)
-                    l2 = np.linalg.norm(v)
-                    theta = np.arccos(np.dot(v, best_vector) / (l1 * l2)) / (
-                        np.pi / 2
-                    )
+        pos = np.array([G.nodes[node]["pos"] for node in range(len(G))])
+        edges = np.array(G.edges, dtype=int).reshape(-1, 2)
+        scores = np.array([G.edges[edge]["score"] for edge in G.edges])
+        # position of each neighbor in the neighbors list of a node
+        neighbors_rank = {
+            (node, neighbor): i
+            for node in G
+            for i, neighbor in enumerate(G.neighbors(node))
+        }
+        edges_list = edges.tolist()
+        rank = np.array(
+            [
+                (neighbors_rank[u, v], neighbors_rank[v, u])
+                for u, v in edges_list
+            ]
+        ).reshape(-1, 2)
+        validity = self._edges_validity(
+            pos, edges, scores, score_threshold, angle_threshold, rank
+        )
+        nx.set_edge_attributes(
+            G,
+            values=dict(zip(map(tuple, edges_list), validity.tolist())),
+            name="validity",
+        )
+        G.remove_edges_from(
+            [edge for edge, v in zip(edges_list, validity) if v < 2]
+        )
 
-                    if theta > angle_threshold and s > score_threshold:
-                        G[node][n]["validity"] += 1
-                        break
+        return G
 
-        edges2remove = []
-        for edge in G.edges():
-            if G.edges[edge]["validity"] < 2:
-                edges2remove.append(edge)
-        G.remove_edges_from(edges2remove)
+    def _edges_validity(
+        self,
+        pos: np.ndarray,
+        edges: np.ndarray,
+        scores: np.ndarray,
+        score_threshold: float = 0.1,
+        angle_threshold: float = 1.2,
+        rank: np.ndarray = None,
+    ) -> np.ndarray:
+        """Counts how many of its two end nodes accept each connection of a
+        scored graph of zdiscs given as arrays. Each node accepts its highest
+        scored connection and the next highest scored connection that makes
+        a large enough angle with it. Among connections with equal scores the
+        one with the higher rank comes first, and nodes with a NaN score
+        accept no connection. Uses a compiled kernel if ``numba`` is
+        installed. See
+        :func:`sarcgraph.sg.SarcGraph._prune_graph` for the description of the
+        thresholds.
 
-        return G
+        Parameters
+        ----------
+        pos : np.ndarray, shape=(N, 2)
+            position of the nodes (zdiscs)
+        edges : np.ndarray, shape=(E, 2)
+            node indices of each connection
+        scores : np.ndarray, shape=(E,)
+            score of each connection
+        rank : np.ndarray, shape=(E, 2), optional
+            position of each connection in the neighbors list of its first and
+            second node, by default the order of ``edges``
+
+        Returns
+        -------
+        np.ndarray, shape=(E,)
+            validity of each connection, connections with validity less than
+            2 are not valid.
+        """
+        num_nodes, num_edges = len(pos), len(edges)
+        validity = np.zeros(num_edges, dtype=int)
+        if num_edges == 0:
+            return validity
+
+        # connections of each node sorted by their scores, stored in arrays
+        # of shape (N, max degree) padded with -inf scores
+        node = np.concatenate((edges[:, 0], edges[:, 1]))
+        neighbor = np.concatenate((edges[:, 1], edges[:, 0]))
+        edge_id = np.concatenate((np.arange(num_edges), np.arange(num_edges)))
+        directed_scores = np.concatenate((scores, scores))
+        if rank is None:
+            directed_rank = edge_id
+        else:
+            directed_rank = np.concatenate((rank[:, 0], rank[:, 1]))
+        # same order as ``np.argsort(scores)[::-1]`` on the neighbors list
+        order = np.lexsort((-directed_rank, -directed_scores, node))
+        node, neighbor = node[order], neighbor[order]
+        edge_id, directed_scores = edge_id[order], directed_scores[order]
+        degree = np.bincount(node, minlength=num_nodes)
+        node_start = np.cumsum(degree) - degree
+
+        if _HAS_NUMBA:
+            accepted = np.zeros(2 * num_edges, dtype=bool)
+            _accept_edges_numba(
+                np.asarray(pos[neighbor] - pos[node], dtype=float),
+                directed_scores.astype(float),
+                node_start,
+                degree,
+                score_threshold,
+                angle_threshold,
+                accepted,
+            )
+            np.add.at(validity, edge_id[accepted], 1)
+            return validity
+
+        rank = np.arange(2 * num_edges) - np.repeat(node_start, degree)
+        max_degree = max(degree.max(), 2)
+        sorted_scores = np.full((num_nodes, max_degree), -np.inf)
+        sorted_scores[node, rank] = directed_scores
+        sorted_edges = np.zeros((num_nodes, max_degree), dtype=int)
+        sorted_edges[node, rank] = edge_id
+        vectors = np.zeros((num_nodes, max_degree, 2))
+        vectors[node, rank] = pos[neighbor] - pos[node]
+
+        # each node accepts its best connection
+        has_nan = np.bincount(
+            node, np.isnan(directed_scores), minlength=num_nodes
+        )
+        has_best = (sorted_scores[:, 0] > score_threshold) & (has_nan == 0)
+        np.add.at(validity, sorted_edges[has_best, 0], 1)
+
+        # and the first among the rest that is far enough in angle from it
+        best_vector = vectors[:, :1]
+        l1 = np.linalg.norm(best_vector, axis=2)
+        l2 = np.linalg.norm(vectors[:, 1:], axis=2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            theta = np.arccos(
+                np.einsum("ijk,ijk->ij", vectors[:, 1:], best_vector)
+                / (l1 * l2)
+            ) / (np.pi / 2)
+        accepted = (
+            (theta > angle_threshold)
+            & (sorted_scores[:, 1:] > score_threshold)
+            & has_best[:, None]
+        )
+        has_second = accepted.any(axis=1)
+        second = 1 + accepted.argmax(axis=1)
+        np.add.at(validity, sorted_edges[has_second, second[has_second]], 1)
+
+        return validity
+
+    def _sarcomeres_to_pandas(
+        self,
+        tracked_zdiscs: pd.DataFrame,
+        sarcs_zdiscs_ids: Union[List[Tuple[int, int]], np.ndarray],
+    ) -> pd.DataFrame:
+        """Creates a pandas dataframe from the information of detected
+        sarcomeres in all frames.
+
+        Parameters
+        ----------
+        tracked_zdiscs : pd.DataFrame
+            Information of tracked zdiscs
+        sarcs_zdiscs_ids : List[Tuple[int, int]] or np.ndarray, shape=(S, 2)
+            particle ids of the two zdiscs forming each sarcomere
+
+        Returns
+        -------
+        pd.DataFrame
+            Columns are ``'frame'`` (frame number), ``'sarc_id'`` (sarcomere
+            id), ``'x'`` and ``'y'`` (sarcomere center position),
+            ``'length'``, ``'width'``, and ``'angle'`` (sarcomere length,
+            width, and angle), and ``'zdiscs'`` (particle id of the two zdiscs
+            forming a sarcomere).
+        """
+        num_frames = tracked_zdiscs.frame.max() + 1
+        frames = np.arange(0, num_frames, 1)
+
+        # zdiscs information in a dense array of shape (particles, frames, 6)
+        # with nan values for frames a zdisc is not tracked in
+        particle_ids, rows = np.unique(
+            tracked_zdiscs.particle.to_numpy(), return_inverse=True
+        )
+        zdiscs_info = np.full((len(particle_ids), len(frames), 6), np.nan)
+        zdiscs_info[rows, tracked_zdiscs.frame.to_numpy().astype(int)] = (
+            tracked_zdiscs[["x", "y", "p1_x", "p1_y", "p2_x", "p2_y"]]
+            .to_numpy()
+            .astype(float)
+        )
+        # rows of the two zdiscs of each sarcomere, particle ids are sorted
+        # but not contiguous (merged zdiscs have negative ids)
+        sarcs_zdiscs_ids = np.array(sarcs_zdiscs_ids, dtype=int).reshape(-1, 2)
+        sarcs_rows = np.searchsorted(particle_ids, sarcs_zdiscs_ids)
+        sarcs_rows = sarcs_rows.clip(max=len(particle_ids) - 1)
+        if not np.array_equal(particle_ids[sarcs_rows], sarcs_zdiscs_ids):
+            raise ValueError(
+                "sarcs_zdiscs_ids must be particle ids of the tracked zdiscs."
+            )
+        z1 = zdiscs_info[sarcs_rows[:, 0]]
+        z2 = zdiscs_info[sarcs_rows[:, 1]]
+
+        # sarcomeres information, each of shape (sarcomeres, frames)
+        x = (z1[..., 0] + z2[..., 0]) / 2
+        y = (z1[..., 1] + z2[..., 1]) / 2
+        length = np.sqrt(
+            (z1[..., 0] - z2[..., 0]) ** 2 + (z1[..., 1] - z2[..., 1]) ** 2
+        )
+        width1 = np.sqrt(
+            (z1[..., 2] - z1[..., 4]) ** 2 + (z1[..., 3] - z1[..., 5]) ** 2
+        )
+        width2 = np.sqrt(
+            (z2[..., 2] - z2[..., 4]) ** 2 + (z2[..., 3] - z2[..., 5]) ** 2
+        )
+        width = (width1 + width2) / 2
+        angle = np.arctan2(z2[..., 0] - z1[..., 0], z2[..., 1] - z1[..., 1])
+        angle[angle < 0] += np.pi
+
+        num_sarcs = len(sarcs_zdiscs_ids)
+        sorted_ids = np.sort(sarcs_zdiscs_ids, axis=1).astype(str)
+        zdiscs = np.char.add(
+            np.char.add(sorted_ids[:, 0], ","), sorted_ids[:, 1]
+        )
+        return pd.DataFrame(
+            {
+                "frame": np.tile(frames, num_sarcs),
+                "sarc_id": np.repeat(np.arange(num_sarcs), len(frames)),
+                "x": x.ravel(),
+                "y": y.ravel(),
+                "length": length.ravel(),
+                "width": width.ravel(),
+                "angle": angle.ravel(),
+                "zdiscs": np.repeat(zdiscs.astype(object), len(frames)),
+            }
+        )
 
     def sarcomere_detection(
         self,
@@ -918,63 +2124,60 @@ class SarcGraph:
             .reset_index()[["x", "y", "particle"]]
             .to_numpy()
         )
-        G = self._zdisc_to_graph(zdiscs_clusters)
-        G = self._score_graph(G, c_avg_length, c_angle, c_diff_length, l_avg)
-        G = self._prune_graph(G, score_threshold, angle_threshold)
-
-        myofibrils = [G.subgraph(c).copy() for c in nx.connected_components(G)]
+        # score and prune the connections between zdiscs as arrays, graphs
+        # are only created for the myofibrils
+        pos, particle_ids = zdiscs_clusters[:, 0:2], zdiscs_clusters[:, 2]
+        edges = self._zdisc_to_edges(pos)
+        scores = self._score_edges(
+            pos, edges, c_avg_length, c_angle, c_diff_length, l_avg
+        )
+        validity = self._edges_validity(
+            pos, edges, scores, score_threshold, angle_threshold
+        )
+        # valid connections in the order of the edges of the pruned graph,
+        # sorted by their lower node index and then by the order they were
+        # added to the graph
+        is_valid = np.flatnonzero(validity >= 2)
+        is_valid = is_valid[np.argsort(edges[is_valid, 0], kind="stable")]
+        edges, scores, validity = (
+            edges[is_valid],
+            scores[is_valid],
+            validity[is_valid],
+        )
 
-        sarcs = []
-        num_frames = tracked_zdiscs.frame.max() + 1
-        z0 = pd.DataFrame(np.arange(0, num_frames, 1), columns=["frame"])
-        for i, edge in enumerate(G.edges):
-            p1 = int(G.nodes[edge[0]]["particle_id"])
-            p2 = int(G.nodes[edge[1]]["particle_id"])
-            z1 = tracked_zdiscs[tracked_zdiscs.particle == p1]
-            z2 = tracked_zdiscs[tracked_zdiscs.particle == p2]
-            z1.columns = np.insert(z2.columns.values[1:] + "_p1", 0, "frame")
-            z2.columns = np.insert(z2.columns.values[1:] + "_p2", 0, "frame")
-
-            sarc = pd.merge(z0, z1, how="outer", on="frame")
-            sarc = pd.merge(sarc, z2, how="outer", on="frame")
-
-            sarc["sarc_id"] = i
-            sarc["zdiscs"] = ",".join(
-                map(str, sorted((p1, p2)))
-            )  # list(map(float, sarc.zdiscs[0].split(',')))
-            sarc["x"] = (sarc.x_p1 + sarc.x_p2) / 2
-            sarc["y"] = (sarc.y_p1 + sarc.y_p2) / 2
-            length = np.sqrt(
-                (sarc.x_p1 - sarc.x_p2) ** 2 + (sarc.y_p1 - sarc.y_p2) ** 2
-            )
-            sarc["length"] = length
-            width1 = np.sqrt(
-                (sarc.p1_x_p1 - sarc.p2_x_p1) ** 2
-                + (sarc.p1_y_p1 - sarc.p2_y_p1) ** 2
-            )
-            width2 = np.sqrt(
-                (sarc.p1_x_p2 - sarc.p2_x_p2) ** 2
-                + (sarc.p1_y_p2 - sarc.p2_y_p2) ** 2
+        # connected groups of zdiscs (myofibrils) ordered by their smallest
+        # node, zdiscs without valid connections form their own groups
+        num_nodes = len(pos)
+        num_myofibrils, labels = connected_components(
+            csr_matrix(
+                (np.ones(len(edges)), (edges[:, 0], edges[:, 1])),
+                shape=(num_nodes, num_nodes),
+            ),
+            directed=False,
+        )
+        edges_labels = labels[edges[:, 0]]
+        nodes_split = np.cumsum(np.bincount(labels, minlength=num_myofibrils))
+        edges_split = np.cumsum(
+            np.bincount(edges_labels, minlength=num_myofibrils)
+        )
+        myofibrils = [
+            self._arrays_to_graph(
+                pos,
+                particle_ids,
+                edges[myo_edges],
+                {"score": scores[myo_edges], "validity": validity[myo_edges]},
+                nodes=myo_nodes,
             )
-            sarc["width"] = (width1 + width2) / 2
-            angle = np.arctan2(sarc.x_p2 - sarc.x_p1, sarc.y_p2 - sarc.y_p1)
-            angle[angle < 0] += np.pi
-            sarc["angle"] = angle
-            sarcs.append(
-                sarc[
-                    [
-                        "frame",
-                        "sarc_id",
-                        "x",
-                        "y",
-                        "length",
-                        "width",
-                        "angle",
-                        "zdiscs",
-                    ]
-                ]
+            for myo_nodes, myo_edges in zip(
+                np.split(np.argsort(labels, kind="stable"), nodes_split[:-1]),
+                np.split(
+                    np.argsort(edges_labels, kind="stable"), edges_split[:-1]
+                ),
             )
-        sarcs = pd.concat(sarcs).reset_index().drop("index", axis=1)
+        ]
+
+        sarcs_zdiscs_ids = particle_ids[edges].astype(int)
+        sarcs = self._sarcomeres_to_pandas(tracked_zdiscs, sarcs_zdiscs_ids)
 
         if save_output:
             self._save_dataframe(sarcs, "sarcomeres")
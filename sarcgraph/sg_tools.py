@@ -6,8 +6,10 @@ import pickle
 import imageio
 import shutil
 import json
+import math
 import os
 
+from itertools import combinations
 from matplotlib.lines import Line2D
 from scipy import signal
 from scipy.signal import find_peaks
@@ -786,58 +788,29 @@ class SarcGraphTools:
             ) as file:
                 pos = pickle.load(file)
 
+            # plain floats, math on 2-vectors is much cheaper than numpy
+            node_pos = {
+                node: (attrs["y_pos"], -attrs["x_pos"])
+                for node, attrs in G.nodes(data=True)
+            }
             for node_1, node_2 in G.edges:
-                pos_1 = np.array(
-                    [G.nodes[node_1]["y_pos"], -G.nodes[node_1]["x_pos"]]
-                )
-                pos_2 = np.array(
-                    [G.nodes[node_2]["y_pos"], -G.nodes[node_2]["x_pos"]]
-                )
-                ang = 1 / np.sqrt(
-                    np.sum(((pos_1 - pos_2) / (pos_1[0] - pos_2[0])) ** 2)
-                )
-                G[node_1][node_2]["weight"] = ang
+                dx = node_pos[node_1][0] - node_pos[node_2][0]
+                dy = node_pos[node_1][1] - node_pos[node_2][1]
+                G[node_1][node_2]["weight"] = abs(dx) / math.hypot(dx, dy)
 
             node_scores = []
             for node in G.nodes:
-                edge_list = list(G.edges(node))
+                unit_vectors = []
+                for node_1, node_2 in G.edges(node):
+                    dx = node_pos[node_1][0] - node_pos[node_2][0]
+                    dy = node_pos[node_1][1] - node_pos[node_2][1]
+                    length = math.hypot(dx, dy)
+                    unit_vectors.append((dx / length, dy / length))
                 counter = 0
                 value = 0
-                for i in range(len(edge_list)):
-                    node_1 = edge_list[i][0]
-                    node_2 = edge_list[i][1]
-
-                    pos_1 = np.array(
-                        [G.nodes[node_1]["y_pos"], -G.nodes[node_1]["x_pos"]]
-                    )
-                    pos_2 = np.array(
-                        [G.nodes[node_2]["y_pos"], -G.nodes[node_2]["x_pos"]]
-                    )
-
-                    vec_1 = (pos_1 - pos_2) / np.linalg.norm(pos_1 - pos_2, 2)
-                    for j in range(i + 1, len(edge_list)):
-                        node_1 = edge_list[j][0]
-                        node_2 = edge_list[j][1]
-
-                        pos_1 = np.array(
-                            [
-                                G.nodes[node_1]["y_pos"],
-                                -G.nodes[node_1]["x_pos"],
-                            ]
-                        )
-                        pos_2 = np.array(
-                            [
-                                G.nodes[node_2]["y_pos"],
-                                -G.nodes[node_2]["x_pos"],
-                            ]
-                        )
-
-                        vec_2 = (pos_1 - pos_2) / np.linalg.norm(
-                            pos_1 - pos_2, 2
-                        )
-
-                        value += np.abs(np.dot(vec_1, vec_2))
-                        counter += 1
+                for (x_1, y_1), (x_2, y_2) in combinations(unit_vectors, 2):
+                    value += abs(x_1 * x_2 + y_1 * y_2)
+                    counter += 1
 
                 if counter:
                     node_scores.append(value / counter)
@@ -1132,7 +1105,7 @@ class SarcGraphTools:
             y_mean = np.nanmean(np.sin(signal))
 
             mean_angle = np.arctan2(y_mean, x_mean)
-            mean_rad = np.linalg.norm([x_mean, y_mean], 2)
+            mean_rad = math.hypot(x_mean, y_mean)
 
             return mean_angle, mean_rad
 
@@ -38,5 +38,6 @@ setup(
         "sk-video==1.1.10",
         "trackpy==0.6.1",
     ],
+    extras_require={"numba": ["numba>=0.56"]},
     zip_safe=False,
 )
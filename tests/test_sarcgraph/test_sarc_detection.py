@@ -1,4 +1,7 @@
+import pytest
 import numpy as np
+import pandas as pd
+import networkx as nx
 from sarcgraph.sg import SarcGraph
 
 sg_vid = SarcGraph("test", "video")
@@ -18,8 +21,15 @@ def test_sarcomere_detection_accuracy():
 
 
 def test_sarcomere_detection_image():
-    sarcomeres, _ = sg_img.sarcomere_detection("samples/sample_5.png")
+    sarcomeres, myofibrils = sg_img.sarcomere_detection("samples/sample_5.png")
     assert not sarcomeres.empty
+    assert sum(len(myo.edges) for myo in myofibrils) == len(sarcomeres)
+    nodes = [node for myo in myofibrils for node in myo.nodes]
+    assert sorted(nodes) == list(range(len(nodes)))
+    assert all(
+        min(myo_1.nodes) < min(myo_2.nodes)
+        for myo_1, myo_2 in zip(myofibrils[:-1], myofibrils[1:])
+    )
 
 
 def test_zdisc_to_graph():
@@ -30,6 +40,18 @@ def test_zdisc_to_graph():
     assert np.array_equal(list(G.nodes[0].keys()), ["pos", "particle_id"])
 
 
+def test_zdisc_to_edges():
+    test_data = np.array([[0, 0, 1], [1, 0, 2], [0, 1, 3], [1, 1, 4]])
+    edges = sg_vid._zdisc_to_edges(test_data[:, 0:2])
+    G = sg_vid._zdisc_to_graph(test_data)
+    assert edges.shape == (6, 2)
+    assert np.all(edges[:, 0] < edges[:, 1])
+    node_major = np.argsort(edges[:, 0], kind="stable")
+    assert np.array_equal(edges[node_major], G.edges)
+    with pytest.raises(ValueError):
+        sg_vid._zdisc_to_edges(test_data[:3, 0:2])
+
+
 def test_score_graph():
     test_data = np.array([[0, 0, 1], [1, 0, 2], [2, 0, 3], [3, 0, 4]])
     G = sg_vid._zdisc_to_graph(test_data)
@@ -39,9 +61,128 @@ def test_score_graph():
     assert G[2][3]["score"] == 3
 
 
+def test_score_edges():
+    pos = np.array([[0, 0], [1, 0], [2, 0], [40, 0]])
+    edges = np.array([[0, 1], [1, 2], [2, 3]])
+    scores = sg_vid._score_edges(pos, edges, 1, 1, 1, 1)
+    assert np.array_equal(scores, [3, 3, 0])
+
+
 def test_prune_graph():
     test_data = np.array([[0, 0, 1], [1, 0, 2], [2, 0, 3], [3, 0, 4]])
     G = sg_vid._zdisc_to_graph(test_data)
     G = sg_vid._score_graph(G, 1, 1, 1, 1)
     G = sg_vid._prune_graph(G, score_threshold=1, angle_threshold=1)
     assert np.array_equal(G.edges, [[0, 1], [1, 2], [2, 3]])
+
+
+def test_edges_validity():
+    pos = np.array([[0, 0], [1, 0], [2, 0], [3, 0]])
+    edges = np.array([[0, 1], [1, 2], [2, 3], [0, 2]])
+    scores = np.array([3, 3, 3, 0.5])
+    validity = sg_vid._edges_validity(pos, edges, scores, 1, 1)
+    assert np.array_equal(validity, [2, 2, 2, 0])
+    validity = sg_vid._edges_validity(pos[:2], edges[:1], scores[:1], 1, 1)
+    assert np.array_equal(validity, [2])
+
+
+def test_edges_validity_ties():
+    # node 0 has two connections with equal scores, the later one is first
+    pos = np.array([[0, 0], [1, 0], [0, 1], [0, -1]])
+    edges = np.array([[0, 1], [0, 2], [0, 3]])
+    scores = np.array([1, 1, 0.5])
+    validity = sg_vid._edges_validity(pos, edges, scores)
+    assert np.array_equal(validity, [1, 2, 2])
+    rank = np.array([[1, 0], [0, 0], [2, 0]])
+    validity = sg_vid._edges_validity(pos, edges, scores, rank=rank)
+    assert np.array_equal(validity, [2, 1, 1])
+    G = nx.Graph()
+    G.add_nodes_from((i, {"pos": p}) for i, p in enumerate(pos))
+    G.add_edges_from([(0, 2), (0, 1), (0, 3)])
+    nx.set_edge_attributes(
+        G, {(0, 1): 1, (0, 2): 1, (0, 3): 0.5}, name="score"
+    )
+    G = sg_vid._prune_graph(G)
+    assert list(G.edges) == [(0, 1)]
+
+
+def test_edges_validity_nan(monkeypatch):
+    # coincident zdiscs give NaN scores, their nodes accept no connection
+    pos = np.array([[0, 0], [1, 0], [2, 0], [3, 0]])
+    edges = np.array([[0, 1], [1, 2], [2, 3], [1, 3]])
+    scores = np.array([3, 3, 3, np.nan])
+    validity = sg_vid._edges_validity(pos, edges, scores, 1, 1)
+    assert np.array_equal(validity, [1, 1, 1, 0])
+    monkeypatch.setattr("sarcgraph.sg._HAS_NUMBA", False)
+    validity = sg_vid._edges_validity(pos, edges, scores, 1, 1)
+    assert np.array_equal(validity, [1, 1, 1, 0])
+
+
+def test_prune_graph_lattices():
+    # equal distances and scores, the results of the original graph code
+    rect = np.array([[i * 10.0, j * 12.0] for i in range(6) for j in range(6)])
+    hexagonal = np.array(
+        [
+            [i * 10.0 + 5 * (j % 2), j * 8.66]
+            for i in range(6)
+            for j in range(6)
+        ]
+    )
+    coincident = np.vstack(
+        [np.random.default_rng(1).random((30, 2)) * 60, [[5, 5], [5, 5]]]
+    )
+    for pos, num_edges in [(rect, 30), (hexagonal, 19), (coincident, 13)]:
+        zdiscs = np.column_stack((pos, np.arange(len(pos))))
+        G = sg_vid._zdisc_to_graph(zdiscs)
+        G = sg_vid._score_graph(G, 1, 1, 1, 12.0)
+        G = sg_vid._prune_graph(G, 0.01, 1.2)
+        assert len(G.edges) == num_edges
+        edges = sg_vid._zdisc_to_edges(pos)
+        scores = sg_vid._score_edges(pos, edges, 1, 1, 1, 12.0)
+        validity = sg_vid._edges_validity(pos, edges, scores, 0.01, 1.2)
+        assert np.sum(validity >= 2) == num_edges
+
+
+def test_score_edges_numba_matches_numpy(monkeypatch):
+    pytest.importorskip("numba")
+    rng = np.random.default_rng(0)
+    pos = 40 * rng.random((50, 2))
+    edges = sg_vid._zdisc_to_edges(pos)
+    scores_numba = sg_vid._score_edges(pos, edges)
+    validity_numba = sg_vid._edges_validity(pos, edges, scores_numba)
+    monkeypatch.setattr("sarcgraph.sg._HAS_NUMBA", False)
+    scores_numpy = sg_vid._score_edges(pos, edges)
+    validity_numpy = sg_vid._edges_validity(pos, edges, scores_numpy)
+    assert np.allclose(scores_numba, scores_numpy)
+    assert np.array_equal(validity_numba, validity_numpy)
+
+
+def test_sarcomeres_to_pandas():
+    tracked_zdiscs = pd.DataFrame(
+        {
+            "frame": [0, 1, 0, 1, 0],
+            "x": [0, 0, 0, 0, 10],
+            "y": [0, 0, 10, 12, 0],
+            "p1_x": [-1, -1, -2, -2, 10],
+            "p1_y": [0, 0, 10, 12, -1],
+            "p2_x": [1, 1, 2, 2, 10],
+            "p2_y": [0, 0, 10, 12, 1],
+            "particle": [3, 3, 5, 5, 7],
+        }
+    )
+    sarcs = sg_vid._sarcomeres_to_pandas(tracked_zdiscs, [(5, 3), (3, 7)])
+    assert len(sarcs) == 4
+    assert np.array_equal(sarcs.frame, [0, 1, 0, 1])
+    assert np.array_equal(sarcs.sarc_id, [0, 0, 1, 1])
+    assert np.array_equal(sarcs.zdiscs, ["3,5", "3,5", "3,7", "3,7"])
+    assert np.allclose(sarcs.length[:3], [10, 12, 10])
+    assert np.allclose(sarcs.width[:3], [3, 3, 2])
+    assert np.allclose(sarcs.angle[:3], [np.pi, np.pi, np.pi / 2])
+    assert np.isnan(sarcs.length[3])
+    tracked_zdiscs["particle"] = [3, 3, 5, 5, -2]
+    sarcs = sg_vid._sarcomeres_to_pandas(tracked_zdiscs, [(3, -2)])
+    assert np.array_equal(sarcs.zdiscs, ["-2,3", "-2,3"])
+    assert np.allclose(sarcs.length[:1], [10])
+    assert sg_vid._sarcomeres_to_pandas(tracked_zdiscs, []).empty
+    with pytest.raises(ValueError):
+        sg_vid._sarcomeres_to_pandas(tracked_zdiscs, [(3, 4)])
@@ -2,7 +2,12 @@ import pytest
 import numpy as np
 import pandas as pd
 import os
-from sarcgraph.sg import SarcGraph
+
+from scipy.spatial import distance_matrix
+from skimage import measure
+from skimage.filters import threshold_otsu
+
+from sarcgraph.sg import SarcGraph, _otsu_thresholds
 
 sg_vid = SarcGraph("test", "video")
 sg_img = SarcGraph("test", "image")
@@ -19,6 +24,30 @@ def test_process_input():
     assert os.path.exists(f"./{sg_vid.output_dir}/filtered-frames.npy")
 
 
+def test_process_input_saved_frames():
+    raw_frames = np.random.default_rng(0).random((3, 20, 30))
+    filtered_frames_1 = sg_vid._process_input(raw_frames=raw_frames)
+    filtered_frames_2 = sg_vid._process_input(raw_frames=raw_frames[:2])
+    saved_frames = np.load(f"./{sg_vid.output_dir}/filtered-frames.npy")
+    assert np.array_equal(saved_frames, filtered_frames_2)
+    assert np.array_equal(filtered_frames_1[:2], filtered_frames_2)
+    assert filtered_frames_1.shape == (3, 20, 30)
+
+
+def test_process_input_failed_filter(monkeypatch):
+    def filter_frames(*args, **kwargs):
+        raise MemoryError
+
+    raw_frames = np.random.default_rng(0).random((3, 20, 30))
+    filtered_frames = sg_vid._process_input(raw_frames=raw_frames)
+    monkeypatch.setattr(sg_vid, "_filter_frames", filter_frames)
+    with pytest.raises(MemoryError):
+        sg_vid._process_input(raw_frames=raw_frames[:2])
+    saved_frames = np.load(f"./{sg_vid.output_dir}/filtered-frames.npy")
+    assert np.array_equal(saved_frames, filtered_frames)
+    assert not os.path.exists(f"./{sg_vid.output_dir}/filtered-frames.npy.tmp")
+
+
 def test_detect_contours_input_fmt():
     with pytest.raises(ValueError):
         SarcGraph()._detect_contours(np.ones((4, 4)))
@@ -34,6 +63,33 @@ def test_detect_contours():
     assert os.path.exists(f"./{sg_vid.output_dir}/contours.npy")
 
 
+def test_detect_contours_workers():
+    filtered_frames = sg_vid._process_input("samples/sample_0.avi")[:6]
+    contours = SarcGraph("test", "video", num_workers=2)._detect_contours(
+        filtered_frames, save_output=False
+    )
+    expected = sg_vid._detect_contours(filtered_frames, save_output=False)
+    assert len(contours) == len(expected)
+    for frame_contours, frame_expected in zip(contours, expected):
+        assert len(frame_contours) == len(frame_expected)
+        for contour, contour_expected in zip(frame_contours, frame_expected):
+            assert np.array_equal(contour, contour_expected)
+
+
+def test_otsu_thresholds():
+    frames = np.random.default_rng(0).random((120, 20, 30))
+    frames[50:] += 1.0
+    thresholds = _otsu_thresholds(frames)
+    assert np.array_equal(thresholds, [threshold_otsu(f) for f in frames])
+    thresholds = _otsu_thresholds(frames, block_size=50)
+    assert thresholds.shape == (120,)
+    assert np.all(thresholds[:50] == threshold_otsu(frames[:50:6]))
+    assert np.all(thresholds[50:100] == threshold_otsu(frames[50:100:6]))
+    assert np.all(thresholds[100:] == threshold_otsu(frames[100::2]))
+    thresholds = _otsu_thresholds(frames[:1], block_size=50)
+    assert thresholds[0] == threshold_otsu(frames[0])
+
+
 def test_contour_processor():
     test_contour_1 = [[-1, -1], [1, 1]]
     test_contour_2 = [[-2, -1], [0, -1], [2, -1], [2, 1], [0, 1], [-2, 1]]
@@ -43,6 +99,30 @@ def test_contour_processor():
     assert np.array_equal(contour_2, [0, 0, -2, -1, 2, 1])
 
 
+def test_contour_processor_long_contour():
+    theta = np.linspace(0, 2 * np.pi, 100)
+    test_contour = np.column_stack((4 * np.cos(theta), np.sin(theta)))
+    dist_mat = distance_matrix(test_contour, test_contour)
+    i, j = np.unravel_index(dist_mat.argmax(), dist_mat.shape)
+    contour = sg_vid._process_contour(test_contour)
+    assert np.array_equal(contour[2:4], test_contour[i])
+    assert np.array_equal(contour[4:], test_contour[j])
+
+
+def test_contours_processor():
+    test_contours = [
+        np.array([[-2, -1], [0, -1], [2, -1], [2, 1], [0, 1], [-2, 1]]),
+        np.array([[0, 0], [1, 2], [3, 1]]),
+    ]
+    with pytest.raises(ValueError):
+        sg_vid._process_contours([np.ones((2, 2))])
+    assert sg_vid._process_contours([]).shape == (0, 6)
+    zdiscs = sg_vid._process_contours(test_contours)
+    assert zdiscs.shape == (2, 6)
+    for zdisc, contour in zip(zdiscs, test_contours):
+        assert np.allclose(zdisc, sg_vid._process_contour(contour))
+
+
 def test_zdiscs_to_pandas():
     with pytest.raises(ValueError):
         sg_vid._zdiscs_to_pandas([np.ones((1, 6))])
@@ -58,9 +138,66 @@ def test_zdiscs_to_pandas():
     assert isinstance(zdiscs_df, pd.DataFrame)
     columns = ["frame", "x", "y", "p1_x", "p1_y", "p2_x", "p2_y"]
     assert set(zdiscs_df.columns) == set(columns)
+    zdiscs_df = sg_vid._zdiscs_to_pandas(
+        [np.ones((2, 6)), np.ones((0, 6)), np.ones((3, 6))]
+    )
+    assert np.array_equal(zdiscs_df.frame, [0, 0, 2, 2, 2])
+    assert np.array_equal(zdiscs_df.index, [0, 1, 0, 1, 2])
 
 
 def test_zdisc_segmentation():
     zdiscs = sg_vid.zdisc_segmentation("samples/sample_0.avi")
     assert zdiscs.frame.max() == 79
     assert len(zdiscs[zdiscs.frame == 0]) == 81
+
+
+def test_zdiscs_from_moments():
+    test_data = np.zeros((2, 20, 20))
+    test_data[0, 5, 3:13] = 1
+    test_data[0, 15, 15:17] = 1
+    test_data[1, 2:12, 8] = 1
+    with pytest.raises(ValueError):
+        sg_vid._zdiscs_from_moments(test_data[0])
+    zdiscs = sg_vid._zdiscs_from_moments(test_data, min_area=8)
+    half_axis = 2 * np.sqrt(8.25)
+    assert len(zdiscs) == 2
+    assert np.allclose(
+        zdiscs[0], [[5, 7.5, 5, 7.5 - half_axis, 5, 7.5 + half_axis]]
+    )
+    assert np.allclose(
+        zdiscs[1], [[6.5, 8, 6.5 - half_axis, 8, 6.5 + half_axis, 8]]
+    )
+
+
+def test_zdiscs_from_moments_matches_regionprops():
+    frame = sg_vid._process_input("samples/sample_0.avi")[0]
+    zdiscs = sg_vid._zdiscs_from_moments(frame[None], min_area=8)[0]
+    labels = measure.label(frame > threshold_otsu(frame), connectivity=1)
+    props = measure.regionprops_table(
+        labels, properties=("centroid", "axis_major_length", "area")
+    )
+    is_valid = props["area"] >= 8
+    centroids = np.stack(
+        (props["centroid-0"][is_valid], props["centroid-1"][is_valid]), axis=1
+    )
+    lengths = np.linalg.norm(zdiscs[:, 4:6] - zdiscs[:, 2:4], axis=1)
+    assert np.allclose(zdiscs[:, :2], centroids)
+    assert np.allclose(lengths, props["axis_major_length"][is_valid])
+
+
+def test_zdiscs_from_moments_numba_matches_numpy(monkeypatch):
+    pytest.importorskip("numba")
+    frames = np.random.default_rng(0).random((3, 41, 37))
+    zdiscs_numba = sg_vid._zdiscs_from_moments(frames, min_area=1)
+    monkeypatch.setattr("sarcgraph.sg._HAS_NUMBA", False)
+    zdiscs_numpy = sg_vid._zdiscs_from_moments(frames, min_area=1)
+    assert len(zdiscs_numba) == len(zdiscs_numpy)
+    for zdiscs_1, zdiscs_2 in zip(zdiscs_numba, zdiscs_numpy):
+        assert np.array_equal(zdiscs_1, zdiscs_2, equal_nan=True)
+
+
+def test_zdisc_segmentation_moments():
+    sg_moments = SarcGraph("test", "video", zdisc_method="moments")
+    zdiscs = sg_moments.zdisc_segmentation("samples/sample_0.avi")
+    assert zdiscs.frame.max() == 79
+    assert len(zdiscs[zdiscs.frame == 0]) == 81
@@ -3,6 +3,8 @@ import pandas as pd
 import os
 import pytest
 
+from sklearn.cluster import OPTICS
+
 from sarcgraph.sg import SarcGraph
 
 sg_vid = SarcGraph()
@@ -62,3 +64,40 @@ def test_zdisc_tracking_input():
     dataframe = pd.DataFrame(columns=columns)
     with pytest.raises(ValueError):
         sg_vid.zdisc_tracking(segmented_zdiscs=dataframe)
+
+
+def test_merge_tracked_zdiscs():
+    tracked_zdiscs = pd.DataFrame(
+        {
+            "frame": [0, 1, 2, 3, 0, 1, 2, 3, 0, 1, 2],
+            "x": [100, 100, 100, 100, 0, 0, 0.5, 0.5, 50, 50, 50],
+            "y": [100, 100, 100, 100, 0, 0, 0, 0, 50, 50, 50],
+            "particle": [0, 0, 0, 0, 1, 1, 2, 2, 3, 3, 3],
+        }
+    )
+    merged_zdiscs = sg_vid._merge_tracked_zdiscs(tracked_zdiscs)
+    assert len(merged_zdiscs) == 8
+    assert set(merged_zdiscs.particle) == {0, -2}
+    assert np.allclose(
+        merged_zdiscs[merged_zdiscs.particle == -2].x, [0, 0, 0.5, 0.5]
+    )
+
+
+def test_optics_labels():
+    # close clusters that the xi extraction of OPTICS splits, and a grid
+    # with equal distances
+    rng = np.random.default_rng(0)
+    blobs = np.concatenate(
+        [
+            rng.normal(center, scale, (40, 2))
+            for center, scale in [((0, 0), 1), ((6, 0), 1), ((30, 30), 3)]
+        ]
+    )
+    grid = 1.5 * np.stack(
+        np.meshgrid(np.arange(20.0), np.arange(20.0)), axis=-1
+    ).reshape(-1, 2)
+    for data, max_eps in [(blobs, 2.0), (grid, 1.6)]:
+        labels = sg_vid._optics_labels(data, max_eps)
+        expected = OPTICS(max_eps=max_eps, min_samples=2).fit_predict(data)
+        assert np.array_equal(labels, expected)
+    assert np.array_equal(sg_vid._optics_labels(blobs[:1], 2.0), [-1])
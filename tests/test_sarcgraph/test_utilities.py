@@ -2,6 +2,9 @@ import pytest
 import numpy as np
 import pandas as pd
 import os
+import threading
+
+from skimage.filters import gaussian, laplace
 
 from sarcgraph.sg import SarcGraph
 
@@ -19,6 +22,25 @@ def test_wrong_file_type():
         SarcGraph(file_type="Image")
 
 
+def test_wrong_zdisc_method():
+    with pytest.raises(ValueError):
+        SarcGraph(zdisc_method="regions")
+
+
+def test_wrong_num_workers():
+    with pytest.raises(TypeError):
+        SarcGraph(num_workers=2.0)
+    with pytest.raises(ValueError):
+        SarcGraph(num_workers=0)
+
+
+def test_wrong_otsu_block_size():
+    with pytest.raises(TypeError):
+        SarcGraph(otsu_block_size=50.0)
+    with pytest.raises(ValueError):
+        SarcGraph(otsu_block_size=0)
+
+
 def test_video_loader_avi():
     frames = sg_vid._to_gray(sg_vid._data_loader("samples/sample_0.avi"))
     assert frames.shape == (80, 368, 368, 1)
@@ -34,6 +56,50 @@ def test_image_loader():
     assert frame.shape == (1, 368, 368, 1)
 
 
+def test_stream_frames():
+    frames = list(sg_vid._stream_frames("samples/sample_0.avi", prefetch=2))
+    assert len(frames) == 80
+    assert frames[0].shape == (1, 368, 368, 1)
+    frames_gray = sg_vid._to_gray(sg_vid._data_loader("samples/sample_0.avi"))
+    assert np.array_equal(np.concatenate(frames), frames_gray)
+
+
+def test_stream_filter_frames():
+    frames_gray, frames_filtered = sg_vid._stream_filter_frames(
+        "samples/sample_0.avi", chunk_size=7
+    )
+    assert frames_gray.shape == (80, 368, 368, 1)
+    assert np.allclose(
+        frames_filtered, sg_vid._filter_frames(frames_gray), atol=1e-4
+    )
+    assert sg_vid._stream_filter_frames("samples/sample_4.png") is None
+
+
+def test_stream_filter_frames_error(monkeypatch):
+    def filter_frames(*args, **kwargs):
+        raise MemoryError
+
+    sg = SarcGraph("test", "video")
+    monkeypatch.setattr(sg, "_filter_frames", filter_frames)
+    num_threads = threading.active_count()
+    with pytest.raises(MemoryError):
+        sg._stream_filter_frames("samples/sample_0.avi")
+    assert threading.active_count() == num_threads
+    assert sg_vid._stream_filter_frames("samples/missing.avi") is None
+
+
+def test_stream_filter_frames_workers():
+    sg_workers = SarcGraph("test", "video", num_workers=2)
+    frames_gray, frames_filtered = sg_workers._stream_filter_frames(
+        "samples/sample_0.avi", chunk_size=7
+    )
+    assert frames_gray.shape == (80, 368, 368, 1)
+    assert np.allclose(
+        frames_filtered, sg_vid._filter_frames(frames_gray), atol=1e-4
+    )
+    assert sg_workers._stream_filter_frames("samples/sample_4.png") is None
+
+
 def test_video_load_as_image():
     with pytest.raises(
         ValueError,
@@ -111,9 +177,39 @@ def test_filtered_data_output():
     test_data[0, :, 32] = 1
     test_data[1, 32, :] = 1
     filtered_data = sg_img._filter_frames(test_data)
+    assert filtered_data.dtype == np.float32
     assert np.array_equal(
         np.argmax(filtered_data[0], axis=1), 32 * np.ones(65)
     )
     assert np.array_equal(
         np.argmax(filtered_data[1], axis=0), 32 * np.ones(65)
     )
+
+
+def test_filtered_data_matches_skimage():
+    rng = np.random.default_rng(0)
+    test_data = rng.random((3, 20, 30))
+    filtered_data = sg_img._filter_frames(test_data, sigma=1.5)
+    for frame, filtered_frame in zip(test_data, filtered_data):
+        expected = gaussian(laplace(frame), sigma=1.5)
+        assert np.allclose(filtered_frame, expected, atol=1e-6)
+
+
+def test_filtered_data_numba_matches_scipy(monkeypatch):
+    pytest.importorskip("numba")
+    rng = np.random.default_rng(0)
+    test_data = rng.random((3, 20, 30))
+    filtered_numba = sg_img._filter_frames(test_data, sigma=1.5)
+    monkeypatch.setattr("sarcgraph.sg._HAS_NUMBA", False)
+    filtered_scipy = sg_img._filter_frames(test_data, sigma=1.5)
+    assert np.allclose(filtered_numba, filtered_scipy, atol=1e-6)
+
+
+def test_filtered_data_workers():
+    rng = np.random.default_rng(0)
+    test_data = rng.random((5, 20, 30))
+    sg_workers = SarcGraph("test", "image", num_workers=2)
+    filtered_data = sg_workers._filter_frames(test_data, sigma=1.5)
+    assert np.allclose(
+        filtered_data, sg_img._filter_frames(test_data, 1.5), atol=1e-6
+    )